@@ -14,36 +14,53 @@ Swaminathan, S., Kragness, H. E., & Schellenberg, E. G. (2021). The Musical Ear
 
 # Set-up
 import os
+import csv
+import json
 import random
 import datetime
 import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass, fields
+from typing import Optional
 from psychopy import visual, core, event, gui, monitors
 from psychopy import prefs
-# Set the audio library preference
-prefs.hardware['audioLib'] = ['pygame', 'pyo', 'PTB', 'sounddevice']
+# Set the audio library preference: the psychtoolbox backend schedules sound onsets in the audio driver
+prefs.hardware['audioLib'] = ['PTB']
+# Use the aggressive low-latency mode (exclusive access to the audio device)
+prefs.hardware['audioLatencyMode'] = 3
 # Now, import sound
 from psychopy import sound
+import psychtoolbox as ptb
 import re
 
 
+# Delay (in seconds) between scheduling a sound and its actual onset
+AUDIO_ONSET_DELAY = 0.05
+
+# Blank interval (in seconds) after a test trial response before the next trial starts
+POST_RESPONSE_ISI = 0.2
+
+# Audio file names, e.g. 'melody_exampleA_ident.wav' or 'rhythm_test12_nonident.wav':
+# test type, phase, example letter or trial number, and whether the two parts are identical
+AUDIO_FILE_PATTERN = re.compile(r'^(melody|rhythm)_(example|test)([^_]+)_(ident|nonident)\.wav$')
+
+
 def check_paths(base_audio_path, base_image_path, results_path):
     """
-    Function checks the existence of specific directories and raises
-    exceptions with appropriate error messages if any of the directories are not found.
+    Function checks the existence of the audio directory and raises an exception with an
+    appropriate error message if it is not found. The image and results directories are created if missing.
     """
 
     # Check if the base audio directory exists
-    if not os.path.exists(base_audio_path):
+    if not os.path.isdir(base_audio_path):
         raise Exception("No audio folder detected. Please make sure that "
                         "'base_audio_path' is correctly set in the configurations")
 
-    # Check if the base image directory exists
-    if not os.path.exists(base_image_path):
-        os.mkdir(base_image_path)
+    # Create the base image directory if it doesn't exist
+    os.makedirs(base_image_path, exist_ok=True)
 
-    # Check if the results directory exists, if not, create it
-    if not os.path.exists(results_path):
-        os.mkdir(results_path)
+    # Create the results directory if it doesn't exist
+    os.makedirs(results_path, exist_ok=True)
 
 
 def get_participant_info():
@@ -69,28 +86,41 @@ def get_participant_info():
 def load_audio_files(base_audio_path, test_type):
     """
     Load audio files for a given test type (melody or rhythm) from a folder.
+    Returns two lists (examples and tests) of (file path, correct answer) tuples,
+    where the correct answer ('yes' or 'no') is taken from the file name.
     """
     # Set the folder path where the audio files are stored
     folder_path = os.path.join(base_audio_path)
-    # Initialize two lists for storing example and test files
-    example_files = []
-    test_files = []
+    # Initialize two lists for storing (example label, example file) and (trial number, test file) pairs
+    example_entries = []
+    test_entries = []
 
     # Iterate through all files in the folder
-    for filename in os.listdir(folder_path):
-        # Check if the file matches the test type (melody or rhythm)
-        if filename.startswith(test_type):
-            # Get the full file path
-            file_path = os.path.join(folder_path, filename)
-            # If the file is an example file, add it to the example_files list
-            if "_example" in filename:
-                example_files.append(file_path)
-            # If the file is a test file, add it to the test_files list at the correct position
-            elif "_test" in filename:
-                # Extract the trial number from the filename
-                trial_number = int(re.findall(r'\d+', filename.split("_test")[1])[0])
-                # Insert the file into the test_files list based on the trial number
-                test_files.insert(trial_number - 1, file_path)
+    with os.scandir(folder_path) as entries:
+        for entry in entries:
+            # Check if the file is an audio file of the test type (melody or rhythm)
+            match = AUDIO_FILE_PATTERN.match(entry.name)
+            if match is None or match.group(1) != test_type:
+                continue
+            # Get the correct answer from the file name
+            correct_answer = 'yes' if match.group(4) == 'ident' else 'no'
+            # If the file is an example file, keep it together with its label (A, B, ...)
+            if match.group(2) == 'example':
+                example_entries.append((match.group(3), (entry.path, correct_answer)))
+            # If the file is a test file, keep it together with its trial number
+            else:
+                test_entries.append((int(match.group(3)), (entry.path, correct_answer)))
+
+    # Order the example files by their label, the directory listing order is arbitrary
+    example_files = [example_file for _, example_file in sorted(example_entries)]
+
+    # Put each test file at the position given by its trial number
+    test_files = [None] * len(test_entries)
+    for trial_number, test_file in test_entries:
+        if not 1 <= trial_number <= len(test_files) or test_files[trial_number - 1] is not None:
+            raise Exception(f"The {test_type} test files in '{folder_path}' are not numbered consecutively "
+                            f"from 1 to {len(test_files)} (found trial number {trial_number}).")
+        test_files[trial_number - 1] = test_file
 
     # Uncomment these lines for checking in IDE
     # print(f"Liste der examples: {example_files}")
@@ -100,56 +130,239 @@ def load_audio_files(base_audio_path, test_type):
     return example_files, test_files
 
 
+def preload_stimuli(file_paths):
+    """
+    Create one sound.Sound object per audio file so the files are decoded once at start-up
+    instead of on every trial. The files are loaded in parallel threads
+    (threads rather than processes, as sound objects cannot be passed between processes).
+    The first file is loaded on the calling thread: this opens the audio stream, which PsychoPy's
+    PTB backend creates without a lock, so the threads all attach to that one stream instead of
+    opening it concurrently.
+
+    :param file_paths: A list of audio file paths
+    :return: A dictionary mapping each file path to its sound.Sound object
+    """
+    def load_stimulus(file_path):
+        return sound.Sound(file_path, preBuffer=-1)
+
+    # Open the audio stream on this thread before loading the other files in parallel
+    stimuli = {file_paths[0]: load_stimulus(file_paths[0])}
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        stimuli.update(zip(file_paths[1:], executor.map(load_stimulus, file_paths[1:])))
+
+    return stimuli
+
+
+def warm_up_audio():
+    """
+    Play a short silent tone so the audio stream is already running when the first stimulus is played,
+    which would otherwise be delayed by the start-up of the audio device. The tone uses the sample rate
+    of the stream opened when the stimuli were preloaded.
+    """
+    warm_up = sound.Sound(value=440, secs=0.01, volume=0.0)
+    warm_up.play()
+    core.wait(0.05)
+
+
+# visual.TextStim objects of the instruction texts, created once per text
+instruction_stims = {}
+
+
+def get_instruction_stim(win, instruction_text):
+    """
+    Return the visual.TextStim showing the given instruction text, creating it on first use.
+    """
+    instructions = instruction_stims.get(instruction_text)
+    if instructions is None:
+        instructions = visual.TextStim(win,
+                                       text=instruction_text,
+                                       wrapWidth=2,
+                                       height=0.1,
+                                       color='black')
+        instruction_stims[instruction_text] = instructions
+    return instructions
+
+
 def display_instructions(win, instruction_text):
     """
     Display instructions on the screen and wait for a key press to continue.
+    The instructions stay on the screen until the next screen is shown.
     """
-    instructions = visual.TextStim(win,
-                                   text=instruction_text,
-                                   wrapWidth=2,
-                                   height=0.1,
-                                   color='black')
+    instructions = get_instruction_stim(win, instruction_text)
     instructions.draw()
     win.flip()
     event.waitKeys()
-    win.flip()
 
 
-def draw_progress_bar(win, trial_number, total_trials, bar_width=1.5, bar_height=0.1):
+@dataclass
+class TrialStimuli:
+    """
+    Visual stimuli shown during a trial. They are created once by create_trial_stimuli and
+    only their text, size and position are updated from trial to trial.
+    """
+    trial_text: visual.TextStim
+    test_type_text: visual.TextStim
+    prompt: visual.TextStim
+    yes_button: visual.Rect
+    no_button: visual.Rect
+    yes_text: visual.TextStim
+    no_text: visual.TextStim
+    background_bar: visual.Rect
+    progress_bar: visual.Rect
+    feedback_correct: visual.TextStim
+    feedback_incorrect: visual.TextStim
+
+
+@dataclass
+class TrialResult:
     """
-    Draw a progress bar in the given PsychoPy window.
+    The result of a single trial, with fields in the order of the result CSV columns
+    (after experiment, subject_ID and date). Times are kept as seconds and only formatted
+    when written to the CSV file.
+    """
+    trial: int
+    type: str
+    phase: str
+    stimulus: str
+    response: str
+    correct: str
+    accuracy: int
+    start_time: float
+    end_time: float
+    duration: float
+    stim_onset_s: float
+    response_s: Optional[float]
+    rt_s: Optional[float]
+
+
+def write_results_to_csv(output_file, results, participant_info):
+    """
+    Write trial results to an open CSV file in one go and flush the file to disk. Start and end times
+    are written as HH:MM:SS times of day, durations as HH:MM:SS and missing values as 'NA'.
 
-    :param win: A PsychoPy window object where the progress bar will be drawn
-    :param trial_number: The current trial number
-    :param total_trials: The total number of trials
+    :param output_file: The open output file
+    :param results: A list of TrialResult objects
+    :param participant_info: A dictionary containing information about the participant
+    """
+    rows = []
+    for result in results:
+        values = asdict(result)
+        values['start_time'] = time.strftime('%H:%M:%S', time.localtime(result.start_time))
+        values['end_time'] = time.strftime('%H:%M:%S', time.localtime(result.end_time))
+        duration = int(result.duration)
+        values['duration'] = f"{duration // 3600:02d}:{duration // 60 % 60:02d}:{duration % 60:02d}"
+        rows.append([participant_info['experiment'], participant_info['subject'], participant_info['cur_date']] +
+                    ['NA' if value is None else value for value in values.values()])
+
+    csv.writer(output_file, lineterminator='\n').writerows(rows)
+    output_file.flush()
+
+
+def create_trial_stimuli(win, bar_width=1.5, bar_height=0.1):
+    """
+    Create the visual stimuli used in every trial.
+
+    :param win: A PsychoPy window object where the stimuli will be drawn
     :param bar_width: The width of the progress bar (default: 1.5)
     :param bar_height: The height of the progress bar (default: 0.1)
+    :return: A TrialStimuli object holding the stimuli
     """
-    # Draw the background bar (gray) using a visual.Rect object
-    background_bar = visual.Rect(win,
+    return TrialStimuli(
+        # Trial number
+        trial_text=visual.TextStim(win,
+                                   text='',
+                                   pos=(-0.7, 0.7),
+                                   height=0.1,
+                                   color='black'),
+        # Test type (melody or rhythm) in German
+        test_type_text=visual.TextStim(win,
+                                       text='',
+                                       pos=(0, 0.7),
+                                       height=0.15,
+                                       color='black'),
+        # Prompt text
+        prompt=visual.TextStim(win,
+                               text='',
+                               pos=(0, 0.35),
+                               height=0.15,
+                               wrapWidth=1,
+                               color='black'),
+        # 'yes' and 'no' buttons and their labels
+        yes_button=visual.Rect(win,
+                               pos=(-0.3, -0.2),
+                               width=0.3,
+                               height=0.3,
+                               fillColor='green'),
+        no_button=visual.Rect(win,
+                              pos=(0.3, -0.2),
+                              width=0.3,
+                              height=0.3,
+                              fillColor='red'),
+        yes_text=visual.TextStim(win,
+                                 text='y \n yes / ja',
+                                 pos=(-0.3, -0.2),
+                                 height=0.1,
+                                 color='white'),
+        no_text=visual.TextStim(win,
+                                text='n \n no / nein',
+                                pos=(0.3, -0.2),
+                                height=0.1,
+                                color='white'),
+        # Progress bar: gray background and black filled portion
+        background_bar=visual.Rect(win,
+                                   pos=(0, -0.7),
+                                   width=bar_width,
+                                   height=bar_height,
+                                   fillColor='gray',
+                                   lineColor='gray'),
+        progress_bar=visual.Rect(win,
                                  pos=(0, -0.7),
                                  width=bar_width,
                                  height=bar_height,
-                                 fillColor='gray',
-                                 lineColor='gray')
+                                 fillColor='black',
+                                 lineColor='black'),
+        # Feedback after practice trials
+        feedback_correct=visual.TextStim(win,
+                                         text="Richtig!",
+                                         pos=(0, 0),
+                                         height=0.25,
+                                         color='black'),
+        feedback_incorrect=visual.TextStim(win,
+                                           text="Falsch!",
+                                           pos=(0, 0),
+                                           height=0.25,
+                                           color='black')
+    )
+
+
+def draw_progress_bar(background_bar, progress_bar, trial_number, total_trials):
+    """
+    Draw a progress bar using the given (pre-built) rectangles. The filled portion is resized
+    and moved to the left end of the background bar, whose width and position are used as they are.
+
+    :param background_bar: The visual.Rect drawn as the gray background of the bar
+    :param progress_bar: The visual.Rect drawn as the black filled portion of the bar
+    :param trial_number: The current trial number
+    :param total_trials: The total number of trials
+    """
+    # Draw the background bar (gray)
     background_bar.draw()
 
     # Calculate the width of the filled portion of the progress bar
+    bar_width = background_bar.width
     filled_portion_width = bar_width * (trial_number / total_trials)
 
     # Draw the progress bar (black) if the filled portion width is greater than 0
     if filled_portion_width > 0:
-        progress_bar = visual.Rect(win,
-                                   pos=(-(bar_width - filled_portion_width) / 2, -0.7),
-                                   width=filled_portion_width,
-                                   height=bar_height,
-                                   fillColor='black',
-                                   lineColor='black')
+        bar_x, bar_y = background_bar.pos
+        progress_bar.width = filled_portion_width
+        progress_bar.pos = (bar_x - (bar_width - filled_portion_width) / 2, bar_y)
         progress_bar.draw()
 
 
-def play_stimulus_and_display_prompt(win, stimulus, prompt_text, time_limit, trial_number, base_image_path,
-                                     total_trials, test_type):
+def play_stimulus_and_display_prompt(win, stimulus, prompt_text, time_limit, trial_number, image_stim,
+                                     total_trials, test_type, trial_stimuli, exp_clock, post_response_isi):
     """
     Play a given auditory stimulus and display a prompt with 'yes' and 'no' buttons.
 
@@ -158,84 +371,69 @@ def play_stimulus_and_display_prompt(win, stimulus, prompt_text, time_limit, tri
     :param prompt_text: The text to display as a prompt
     :param time_limit: The time limit for collecting a response (in seconds)
     :param trial_number: The current trial number
-    :param base_image_path: The path to the image to display
+    :param image_stim: The (pre-built) visual.ImageStim to display
     :param total_trials: The total number of trials
     :param test_type: The type of the test ('melody' or 'rhythm')
-    :return: The collected response ('yes', 'no', or 'NA' if no response)
+    :param trial_stimuli: The TrialStimuli object holding the visual stimuli of a trial
+    :param exp_clock: The core.MonotonicClock used for the timestamps of the experiment
+    :param post_response_isi: The time to show a blank screen after the response (in seconds)
+    :return: The collected response ('yes', 'no', or 'NA' if no response), the stimulus onset on exp_clock
+             (in seconds) and the response time from stimulus onset (in seconds, None if no response)
     """
-    # Play the auditory stimulus
-    stimulus.play()
+    # Update the trial number, the test type (in German) and the prompt text. Setting the text of a
+    # TextStim lays it out again, so the texts that stay the same during a test are only set when they change
+    trial_text = trial_stimuli.trial_text
+    trial_text.text = f"{trial_number}"
+    testType = trial_stimuli.test_type_text
+    german_test_type = 'Melodie' if test_type == 'melody' else 'Rhythmus'
+    if testType.text != german_test_type:
+        testType.text = german_test_type
+    prompt = trial_stimuli.prompt
+    if prompt.text != prompt_text:
+        prompt.text = prompt_text
 
-    # Display trial number using a visual.TextStim object
-    trial_text = visual.TextStim(win,
-                                 text=f"{trial_number}",
-                                 pos=(-0.7, 0.7),
-                                 height=0.1,
-                                 color='black')
-    trial_text.draw()
+    # Clear keyboard events left over from previous screens
+    event.clearEvents(eventType='keyboard')
 
-    # Display test type (melody or rhythm) in German
-    german_test_type = 'Melodie' if test_type == 'melody' else 'Rhythmus'
-    testType = visual.TextStim(win,
-                               text=german_test_type,
-                               pos=(0, 0.7),
-                               height=0.15,
-                               color='black')
-    testType.draw()
+    # Schedule the onset of the stimulus for a screen refresh shortly ahead, the trial screen is shown
+    # on that same refresh so the auditory and visual onsets coincide
+    onset = win.getFutureFlipTime(targetTime=AUDIO_ONSET_DELAY, clock='ptb')
+    stimulus.play(when=onset)
+    # Clock measuring response times from the scheduled stimulus onset, i.e. reading 0 at the onset.
+    # Note PsychoPy's sign convention: after Clock.reset(newT) the clock reads -newT, not newT
+    stim_clock = core.Clock()
+    stim_clock.reset(onset - ptb.GetSecs())
+    stim_onset = exp_clock.getTime() - stim_clock.getTime()
+
+    # Keep the screen blank until the refresh of the stimulus onset
+    while win.getFutureFlipTime(clock='ptb') < onset - win.monitorFramePeriod / 2:
+        win.flip()
 
-    # Display the prompt text using a visual.TextStim object
-    prompt = visual.TextStim(win,
-                             text=prompt_text,
-                             pos=(0, 0.35),
-                             height=0.15,
-                             wrapWidth=1,
-                             color='black')
+    # Draw the trial number, test type, prompt, image and progress bar once, the screen does not change
+    # while the stimulus is playing
+    trial_text.draw()
+    testType.draw()
     prompt.draw()
-
-    # Display the image using a visual.ImageStim object
-    image_stim = visual.ImageStim(win,
-                                  image=base_image_path,
-                                  pos=(0, -0.1))
     image_stim.draw()
-
     # Display the progress bar using the draw_progress_bar function
     if trial_number <= total_trials:
-        draw_progress_bar(win, trial_number, total_trials)
-
+        draw_progress_bar(trial_stimuli.background_bar, trial_stimuli.progress_bar, trial_number, total_trials)
     win.flip()
 
-    # Wait for the stimulus duration and clear keyboard events
-    core.wait(stimulus.getDuration() + 1)
-    event.clearEvents(eventType='keyboard')
+    # Block until the stimulus has finished playing, collecting early responses in the meantime
+    key_press = event.waitKeys(maxWait=max(stimulus.getDuration() - stim_clock.getTime(), 0),
+                               keyList=['y', 'n'],
+                               timeStamped=stim_clock) or []
 
-    # Create 'yes' and 'no' buttons using visual.Rect objects and text stimuli
-    yes_button = visual.Rect(win,
-                             pos=(-0.3, -0.2),
-                             width=0.3,
-                             height=0.3,
-                             fillColor='green')
-    no_button = visual.Rect(win,
-                            pos=(0.3, -0.2),
-                            width=0.3,
-                            height=0.3,
-                            fillColor='red')
-    yes_text = visual.TextStim(win,
-                               text='y \n yes / ja',
-                               pos=(-0.3, -0.2),
-                               height=0.1,
-                               color='white')
-    no_text = visual.TextStim(win,
-                              text='n \n no / nein',
-                              pos=(0.3, -0.2),
-                              height=0.1,
-                              color='white')
-
-    # Wait for the specified time limit and collect responses
-    response = None
-    if time_limit is not None:
-        timer = core.CountdownTimer(time_limit)
-    while time_limit is None or timer.getTime() > 0:
-        # Draw the prompt, buttons, and text on the window
+    # 'yes' and 'no' buttons and their labels
+    yes_button = trial_stimuli.yes_button
+    no_button = trial_stimuli.no_button
+    yes_text = trial_stimuli.yes_text
+    no_text = trial_stimuli.no_text
+
+    # Wait for the specified time limit and collect responses, unless one was given during playback
+    if not key_press:
+        # Draw the prompt, buttons, and text on the window once, the screen does not change while waiting
         prompt.draw()
         yes_button.draw()
         yes_text.draw()
@@ -243,11 +441,18 @@ def play_stimulus_and_display_prompt(win, stimulus, prompt_text, time_limit, tri
         no_text.draw()
         win.flip()
 
-        # Check for keyboard responses
-        key_press = event.getKeys(keyList=['y', 'n'])
-        if key_press:
-            response = key_press[0]
-            break
+        # Block until a key is pressed or the time limit (if any) has passed. The keyboard events were
+        # cleared before the stimulus onset, so keep keys pressed while the buttons were being drawn
+        key_press = event.waitKeys(maxWait=time_limit if time_limit is not None else float('inf'),
+                                   keyList=['y', 'n'],
+                                   timeStamped=stim_clock,
+                                   clearEvents=False) or []
+
+    # Stop the stimulus, it may still be playing after an early response, and rewind it for the next play
+    stimulus.stop()
+
+    # Each key press is a (key, time since stimulus onset) pair
+    response, rt = key_press[0] if key_press else (None, None)
 
     # Translate the response from 'y' and 'n' to 'yes' and 'no'
     if response == 'y':
@@ -257,31 +462,26 @@ def play_stimulus_and_display_prompt(win, stimulus, prompt_text, time_limit, tri
     else:
         response = 'NA'
 
-    # Clear the screen after collecting the response
-    win.flip()
-    core.wait(1)
+    # Show a blank screen after collecting the response (if any), otherwise the next screen replaces this one
+    if post_response_isi > 0:
+        win.flip()
+        core.wait(post_response_isi)
 
-    return response
+    return response, stim_onset, rt
 
 
-def display_feedback(win, correct):
+def display_feedback(win, correct, trial_stimuli):
     """
     Display feedback (correct or incorrect) after the participant's response.
 
     Parameters:
     win (visual.Window): The PsychoPy window to display feedback on.
     correct (bool): Whether the participant's response was correct.
+    trial_stimuli (TrialStimuli): The visual stimuli holding the feedback texts.
     """
 
     # Choose the appropriate feedback text based on the correctness of the response
-    feedback_text = "Richtig!" if correct else "Falsch!"
-
-    # Create a visual text stimulus with the feedback text
-    feedback = visual.TextStim(win,
-                               text=feedback_text,
-                               pos=(0, 0),
-                               height=0.25,
-                               color='black')
+    feedback = trial_stimuli.feedback_correct if correct else trial_stimuli.feedback_incorrect
 
     # Draw the feedback text on the window
     feedback.draw()
@@ -289,160 +489,133 @@ def display_feedback(win, correct):
     # Update the window to show the feedback text
     win.flip()
 
-    # Wait for 1 second before clearing the feedback text
+    # Show the feedback text for 1 second, it is replaced by the next screen
     core.wait(1)
 
-    # Clear the window after displaying the feedback
-    win.flip()
-
 
-def musical_ear_test(win, test_type, example_files, test_files, instruction_texts, practice_output_filename, test_output_filename, base_image_path, participant_info):
+def musical_ear_test(win, test_type, example_files, test_files, instruction_texts, practice_output_file, test_output_file, log_file, image_stim, participant_info, stimuli, trial_stimuli, exp_clock):
 
     """
-    Perform the musical ear test using given example and test files, and save results progressively to the output file.
+    Perform the musical ear test using given example and test files. Each result is logged progressively to the
+    log file, and the results of each phase are written to the output file at the end of the phase.
 
     Parameters:
     win (visual.Window): The PsychoPy window to display the test on.
     test_type (str): The type of the test, either 'melody' or 'rhythm'.
-    example_files (list): A list of example audio file paths.
-    test_files (list): A list of test audio file paths.
+    example_files (list): A list of (example audio file path, correct answer) tuples.
+    test_files (list): A list of (test audio file path, correct answer) tuples.
     instruction_texts (dict): A dictionary containing the instruction texts.
-    practice_output_filename (str): The name of the output file to save practice trial results.
-    test_output_filename (str): The name of the output file to save test trial results.
-    base_image_path (str): The base path of the image files to display during the test.
+    practice_output_file (file): The open output file to save practice trial results to.
+    test_output_file (file): The open output file to save test trial results to.
+    log_file (file): The open JSON lines file to log each trial result to as soon as it is collected.
+    image_stim (visual.ImageStim): The image to display during the test.
+    participant_info (dict): A dictionary containing information about the participant.
+    stimuli (dict): A dictionary mapping audio file paths to preloaded sound.Sound objects.
+    trial_stimuli (TrialStimuli): The visual stimuli shown during each trial.
+    exp_clock (core.MonotonicClock): The clock used for the high-precision timestamps of stimulus onsets and responses.
     """
 
-    # Initialize results list
-    results = []
-
     # German translations for test types
     german_test_type = {
         "melody": "Melodien",
         "rhythm": "Rhythmen"  # German plurals for prompt
     }
+    # The prompt is the same for all trials of the test
+    prompt_text = f"Sind die {german_test_type[test_type]} identisch?"
 
-    # Function to append a single result to the CSV file
-    def append_result_to_csv(result, practice_filename, test_filename, participant_info):
+    # Function to log a single result, so no result is lost if the experiment crashes
+    def log_result(result):
         """
-        Appends the given participant's test results to a CSV file. The function determines which file to write to (practice or test)
-        based on the 'phase' key in the 'result' dictionary.
+        Append the given result as one JSON line to the log file.
 
         Parameters:
-        result (dict): A dictionary containing the participant's results from the test. It should include keys like 'trial', 'type',
-        'phase', 'stimulus', 'response', 'correct', 'accuracy', 'start_time', 'end_time', and 'duration'.
+        result (TrialResult): The result of a trial.
+        """
+        log_file.write(json.dumps(asdict(result)) + '\n')
 
-        practice_filename (str): The name of the file where practice results should be written.
+    # Start recording the duration of each task: the start as time of day and on exp_clock
+    start_time = time.time()
+    start_clock_time = exp_clock.getTime()
 
-        test_filename (str): The name of the file where test results should be written.
+    # Function to run the trials of one phase
+    def run_trials(files, phase, time_limit, feedback):
+        """
+        Run the trials of one phase and log the result of each trial.
 
-        participant_info (dict): A dictionary containing information about the participant. It should include keys 'subject'
-        and 'cur_date' (current date).
+        Parameters:
+        files (list): A list of (audio file path, correct answer) tuples.
+        phase (str): The phase of the trials, either 'practice' or 'test'.
+        time_limit (float): The time limit for collecting a response (in seconds), None for no time limit.
+        feedback (bool): Whether to display feedback and the practice instructions after each trial.
 
         Returns:
-        None
+        list: A list of TrialResult objects.
         """
-        output_filename = practice_filename if result['phase'] == 'practice' else test_filename
-        with open(output_filename, 'a') as output_file:
-            output_file.write(
-                f"{participant_info['experiment']},{participant_info['subject']},{participant_info['cur_date']},{result['trial']},{result['type']},{result['phase']},{result['stimulus']},{result['response']},{result['correct']},{result['accuracy']},{result['start_time']},{result['end_time']},{result['duration']}\n"
-            )
-
-    # Start recording the duration of each task
-    start_time = time.time()
-    start_time_str = datetime.datetime.fromtimestamp(start_time).strftime('%H:%M:%S')
+        results = []
+        for i, (audio_file, correct_answer) in enumerate(files):
+            # Play stimulus and display prompt
+            response, stim_onset, rt = play_stimulus_and_display_prompt(win,
+                                                                        stimuli[audio_file],
+                                                                        prompt_text,
+                                                                        time_limit=time_limit,
+                                                                        trial_number=i + 1,
+                                                                        image_stim=image_stim,
+                                                                        total_trials=len(files),
+                                                                        test_type=test_type,
+                                                                        trial_stimuli=trial_stimuli,
+                                                                        exp_clock=exp_clock,
+                                                                        # The feedback screen follows immediately
+                                                                        post_response_isi=0 if feedback else POST_RESPONSE_ISI
+                                                                        )
+            accuracy = 1 if response == correct_answer else (99 if response == "NA" else 0)
+
+            # Record the duration (end time is derived from it)
+            duration = exp_clock.getTime() - start_clock_time
+
+            # Store the result and log it
+            results.append(TrialResult(trial=i + 1,
+                                       type=test_type,
+                                       phase=phase,
+                                       stimulus=audio_file,
+                                       response=response,
+                                       correct=correct_answer,
+                                       accuracy=accuracy,
+                                       start_time=start_time,
+                                       end_time=start_time + duration,
+                                       duration=round(duration, 6),
+                                       stim_onset_s=round(stim_onset, 6),
+                                       response_s=None if rt is None else round(stim_onset + rt, 6),
+                                       rt_s=None if rt is None else round(rt, 6)))
+            log_result(results[-1])
+
+            if feedback:
+                # Display feedback (correct or incorrect) after each example trial
+                display_feedback(win, response == correct_answer, trial_stimuli)
+
+                # Display practice instructions after each example trial
+                display_instructions(win, instruction_texts[f'{test_type}_practice_{correct_answer}'])
+
+        return results
 
     # Display part1 instructions
     display_instructions(win, instruction_texts[f'{test_type}_part1'])
 
-    # Practice trials
-    for i, example_file in enumerate(example_files):
-        # Play stimulus and display prompt
-        response = play_stimulus_and_display_prompt(win,
-                                                    sound.Sound(example_file),
-                                                    f"Sind die {german_test_type[test_type]} identisch?",
-                                                    time_limit=None,  # Set time_limit=None for practice trials
-                                                    trial_number=i + 1,
-                                                    base_image_path=os.path.join(base_image_path, f"{test_type}.png"),
-                                                    # Display corresponding image
-                                                    total_trials=len(example_files),
-                                                    test_type=test_type
-                                                    )
-        # Get the correct answer from the file name
-        correct_answer = 'yes' if example_file.split('_')[-1].startswith('ident') else 'no'
-        accuracy = 1 if response == correct_answer else (99 if response == "NA" else 0)
-
-        # Record end time and duration
-        end_time = time.time()
-        end_time_str = datetime.datetime.fromtimestamp(end_time).strftime('%H:%M:%S')
-        duration = end_time - start_time
-        hours, remainder = divmod(duration, 3600)
-        minutes, seconds = divmod(remainder, 60)
-        duration_str = '{:02d}:{:02d}:{:02d}'.format(int(hours), int(minutes), int(seconds))
-
-        # Store the result and append it to the CSV file
-        results.append({
-            'trial': i + 1,
-            'type': test_type,
-            'phase': 'practice',
-            'stimulus': example_file,
-            'response': response,
-            'correct': correct_answer,
-            'accuracy': accuracy,
-            'start_time': start_time_str,
-            'end_time': end_time_str,
-            'duration': duration_str
-        })
-        append_result_to_csv(results[-1], practice_output_filename, test_output_filename, participant_info)
-
-        # Display feedback (correct or incorrect) after each example trial
-        display_feedback(win, response == correct_answer)
-
-        # Display practice instructions after each example trial
-        display_instructions(win, instruction_texts[f'{test_type}_practice_{correct_answer}'])
+    # Practice trials without a time limit, followed by feedback
+    practice_results = run_trials(example_files, 'practice', time_limit=None, feedback=True)
+
+    # Write the practice results to the CSV file
+    write_results_to_csv(practice_output_file, practice_results, participant_info)
 
     # Display instructions for test trials
     display_instructions(win, instruction_texts[f'{test_type}_part2'])
 
-    # Test trials
-    for i, test_file in enumerate(test_files):
-        # Play stimulus and display prompt for test trials with a time limit of 2 seconds
-        response = play_stimulus_and_display_prompt(win,
-                                                    sound.Sound(test_file),
-                                                    f"Sind die {german_test_type[test_type]} identisch?",
-                                                    time_limit=2,
-                                                    trial_number=i + 1,
-                                                    base_image_path=os.path.join(base_image_path, f"{test_type}.png"),
-                                                    total_trials=len(test_files),
-                                                    test_type=test_type
-                                                    )
-        # Get the correct answer from the file name
-        correct_answer = 'yes' if test_file.split('_')[-1].startswith('ident') else 'no'
-        accuracy = 1 if response == correct_answer else (99 if response == "NA" else 0)
-
-        # Record end time and duration
-        end_time = time.time()
-        end_time_str = datetime.datetime.fromtimestamp(end_time).strftime('%H:%M:%S')
-        duration = end_time - start_time
-        hours, remainder = divmod(duration, 3600)
-        minutes, seconds = divmod(remainder, 60)
-        duration_str = '{:02d}:{:02d}:{:02d}'.format(int(hours), int(minutes), int(seconds))
-
-        # Store the result and append it to the CSV file
-        results.append({
-            'trial': i + 1,
-            'type': test_type,
-            'phase': 'test',
-            'stimulus': test_file,
-            'response': response,
-            'correct': correct_answer,
-            'accuracy': accuracy,
-            'start_time': start_time_str,
-            'end_time': end_time_str,
-            'duration': duration_str
-        })
-        append_result_to_csv(results[-1], practice_output_filename, test_output_filename, participant_info)
-
-    return results
+    # Test trials with a time limit of 2 seconds
+    test_results = run_trials(test_files, 'test', time_limit=2, feedback=False)
+
+    # Write the test results to the CSV file
+    write_results_to_csv(test_output_file, test_results, participant_info)
+
+    return practice_results + test_results
 
 
 def main():
@@ -546,69 +719,94 @@ def main():
                          screen=1,  # Specify the index of the second screen (0 for the first screen, 1 for the second, etc.)
                          allowGUI=True,
                          fullscr=True,
-                         color=(255, 255, 255)
+                         color=(255, 255, 255),
+                         waitBlanking=True  # Synchronise flips with the screen refresh
                          )
     win.flip()
 
-    # Load melody and rhythm files from the 'audio' folder
-    melody_example_files, melody_test_files = load_audio_files(base_audio_path, 'melody')
-    rhythm_example_files, rhythm_test_files = load_audio_files(base_audio_path, 'rhythm')
+    # Create the visual stimuli shown during the trials once, they are updated per trial
+    trial_stimuli = create_trial_stimuli(win)
+    # Lay out all instruction texts before the experiment starts
+    for instruction_text in instruction_texts.values():
+        get_instruction_stim(win, instruction_text)
+    # Load the image of each test type once
+    image_stims = {test_type: visual.ImageStim(win,
+                                               image=os.path.join(base_image_path, f"{test_type}.png"),
+                                               pos=(0, -0.1))
+                   for test_type in ['melody', 'rhythm']}
+
+    # Load the (example files, test files) of melody and rhythm from the 'audio' folder
+    audio_files = {test_type: load_audio_files(base_audio_path, test_type) for test_type in ['melody', 'rhythm']}
+
+    # Preload all stimuli once so no audio file is decoded during the trials
+    audio_file_paths = [file_path
+                        for example_files, test_files in audio_files.values()
+                        for file_path, _ in example_files + test_files]
+    stimuli = preload_stimuli(audio_file_paths)
+
+    # Start the audio stream with a silent sound before the first trial
+    warm_up_audio()
 
     # Determine random starting test
     starting_tests = ['melody', 'rhythm']
     random.shuffle(starting_tests)
 
     # path setup results per participant
+    subject = participant_info['subject']
     # Define the path in results for each subject
-    subj_path_results = os.path.join(results_path, participant_info['subject'])
+    subj_path_results = os.path.join(results_path, subject)
     # Create the directory if it doesn't exist
-    if not os.path.exists(subj_path_results):
-        os.makedirs(subj_path_results)
-
-    # Create the output files with headers and save them in results/
-    practice_output_filename = os.path.join(subj_path_results,
-                                            f"MET_practice_results_{participant_info['subject']}_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}.csv")
-    test_output_filename = os.path.join(subj_path_results,
-                                        f"MET_test_results_{participant_info['subject']}_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}.csv")
-
-    for output_file in [practice_output_filename, test_output_filename]:
-        with open(output_file, 'w') as file:
-            file.write(
-                'experiment,subject_ID,date,trial,type,phase,stimulus,response,correct,accuracy,start_time,end_time,duration \n'
-                )
-
-    # Run the tests in random order
-    for i, test in enumerate(starting_tests):
-        # Display general instructions only once before the first practice trials
-        if i == 0:
-            display_instructions(win, instruction_texts['general_intro'])
-
-        # Run the melody or rhythm test depending on the current test type
-        if test == 'melody':
-            musical_ear_test(
-                win,
-                'melody',
-                melody_example_files,
-                melody_test_files,
-                instruction_texts,
-                practice_output_filename,
-                test_output_filename,
-                base_image_path,
-                participant_info
-            )
-
-        elif test == 'rhythm':
+    os.makedirs(subj_path_results, exist_ok=True)
+
+    # Create the output files in results/, using the same timestamp for all file names
+    timestamp = datetime.datetime.now().strftime('%Y%m%d_%H%M%S')
+    practice_output_filename = os.path.join(subj_path_results, f"MET_practice_results_{subject}_{timestamp}.csv")
+    test_output_filename = os.path.join(subj_path_results, f"MET_test_results_{subject}_{timestamp}.csv")
+    log_filename = os.path.join(subj_path_results, f"MET_log_{subject}_{timestamp}.jsonl")
+
+    # Keep the output files open (and buffered) while the tests are running
+    practice_output_file = open(practice_output_filename, 'w', buffering=1 << 16, newline='')
+    test_output_file = open(test_output_filename, 'w', buffering=1 << 16, newline='')
+    # The log file is line buffered, so every trial result reaches the disk immediately
+    log_file = open(log_filename, 'w', buffering=1)
+
+    try:
+        # Write the headers, the result columns follow the fields of TrialResult
+        header = ['experiment', 'subject_ID', 'date'] + [field.name for field in fields(TrialResult)]
+        for output_file in [practice_output_file, test_output_file]:
+            csv.writer(output_file, lineterminator='\n').writerow(header)
+
+        # Clock for the high-precision (monotonic) timestamps of stimulus onsets and responses,
+        # it cannot be reset so all timestamps of a session share the same origin
+        exp_clock = core.MonotonicClock()
+
+        # Run the tests in random order
+        for i, test in enumerate(starting_tests):
+            # Display general instructions only once before the first practice trials
+            if i == 0:
+                display_instructions(win, instruction_texts['general_intro'])
+
+            # Run the melody or rhythm test depending on the current test type
+            example_files, test_files = audio_files[test]
             musical_ear_test(
                 win,
-                'rhythm',
-                rhythm_example_files,
-                rhythm_test_files,
+                test,
+                example_files,
+                test_files,
                 instruction_texts,
-                practice_output_filename,
-                test_output_filename,
-                base_image_path,
-                participant_info
+                practice_output_file,
+                test_output_file,
+                log_file,
+                image_stims[test],
+                participant_info,
+                stimuli,
+                trial_stimuli,
+                exp_clock
             )
+    finally:
+        # Close the output files, also when the experiment is quit early (core.quit raises SystemExit)
+        for output_file in [practice_output_file, test_output_file, log_file]:
+            output_file.close()
 
     # Display the end instruction after the last trial of the second test trials
     display_instructions(win, instruction_texts['end'])